@@ -0,0 +1,671 @@
+#!/usr/bin/env python3
+"""Browse themes with pre-rendered status line previews in a popup."""
+import functools
+import hashlib
+import json
+import os
+import re
+import select
+import sys
+import termios
+import time
+import tty
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+import optimizer
+from eutmux import (
+    UTF_8,
+    Constructor,
+    Theme,
+    eutmux_homes,
+    find_theme_file,
+    load_config,
+)
+from utils import atomic_write, get_tmux_option
+
+# sources of these modules are hashed into preview key, so that cached
+# previews are renewed when rendering is changed
+RENDERING_MODULES = (
+    __name__,
+    "eutmux",
+    "optimizer",
+    "terminal",
+    "peelee.color",
+)
+PREVIEW_EXTENSION = ".ansi"
+
+CSI = "\033["
+SGR_RESET = f"{CSI}0m"
+REGEX_OPTION_COMMAND = re.compile(r"^set-option -gq (\S+) '(.*)'$")
+
+# sample values to render formats without a live tmux server
+SAMPLE_TIME = time.struct_time((2024, 6, 14, 9, 41, 0, 4, 166, -1))
+SAMPLE_WINDOWS = ("zsh", "vim", "git", "htop", "logs")
+SAMPLE_ACTIVE_WINDOW = 1
+SAMPLE_VARIABLES = {
+    "session_name": "main",
+    "session_windows": str(len(SAMPLE_WINDOWS)),
+    "active_window_index": str(SAMPLE_ACTIVE_WINDOW),
+    "pane_current_path": os.path.expanduser("~/projects/eutmux"),
+    "pane_title": "eutmux",
+    "pane_index": "0",
+    "pane_id": "%0",
+    "host": "localhost",
+    "host_short": "localhost",
+    "client_prefix": "0",
+}
+SAMPLE_COMMANDS = {
+    "gitstatus.py": "main ↑1 *",
+    "cpu.sh": "7.5%",
+    "memory.sh": "41.25%",
+    "disk.sh": "63.08%",
+}
+SHORT_VARIABLES = {
+    "S": "session_name",
+    "I": "window_index",
+    "W": "window_name",
+    "F": "window_flags",
+    "H": "host",
+    "h": "host_short",
+    "P": "pane_index",
+    "T": "pane_title",
+    "D": "pane_id",
+}
+
+NAMED_COLORS = (
+    "black",
+    "red",
+    "green",
+    "yellow",
+    "blue",
+    "magenta",
+    "cyan",
+    "white",
+)
+ATTRIBUTE_CODES = {
+    "bold": 1,
+    "bright": 1,
+    "dim": 2,
+    "italics": 3,
+    "underscore": 4,
+    "blink": 5,
+    "reverse": 7,
+    "hidden": 8,
+    "strikethrough": 9,
+    "double-underscore": 21,
+    "curly-underscore": 4,
+    "dotted-underscore": 4,
+    "dashed-underscore": 4,
+    "overline": 53,
+}
+
+
+def split_arguments(value):
+    """Split arguments of format by commas which are not nested."""
+    arguments = []
+    start = 0
+    index = 0
+    while index < len(value):
+        if value.startswith("##", index) or value.startswith("#,", index):
+            index += 2
+        elif value.startswith("#{", index) or value.startswith("#(", index):
+            opening = value[index + 1]
+            index = optimizer.skip_nested(
+                value, index, opening, "}" if opening == "{" else ")"
+            )
+        elif value[index] == ",":
+            arguments.append(value[start:index])
+            index += 1
+            start = index
+        else:
+            index += 1
+    arguments.append(value[start:])
+    return arguments
+
+
+def is_true(value):
+    """Return True if expanded value is true for tmux conditions."""
+    return value not in ("", "0")
+
+
+def _number(value):
+    try:
+        return float(value) if "." in value else int(value)
+    except ValueError:
+        return 0
+
+
+COMPARISONS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    ">": lambda a, b: a > b,
+    "<=": lambda a, b: a <= b,
+    ">=": lambda a, b: a >= b,
+}
+ARITHMETICS = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "/": lambda a, b: a / b if b else 0,
+    "m": lambda a, b: a % b if b else 0,
+}
+
+
+def expand_variable(content, variables):
+    """Expand content of #{...}, which is not a conditional."""
+    operator, separator, rest = content.partition(":")
+    if not separator:
+        return variables.get(content, "")
+    arguments = [
+        expand(argument, variables) for argument in split_arguments(rest)
+    ]
+    if operator == "&&":
+        return "1" if all(is_true(value) for value in arguments) else "0"
+    if operator == "||":
+        return "1" if any(is_true(value) for value in arguments) else "0"
+    if operator == "!":
+        return "0" if is_true(arguments[0]) else "1"
+    if operator in COMPARISONS and len(arguments) == 2:
+        return "1" if COMPARISONS[operator](*arguments) else "0"
+    if operator.startswith("e|") and len(arguments) == 2:
+        operation = operator.split("|")[1]
+        left, right = (_number(value) for value in arguments)
+        if operation in COMPARISONS:
+            return "1" if COMPARISONS[operation](left, right) else "0"
+        if operation in ARITHMETICS:
+            return str(ARITHMETICS[operation](left, right))
+        return ""
+    # modifiers of variable. e.g. #{b:pane_current_path}, #{=10:window_name}
+    value = variables.get(rest, "")
+    if operator == "b":
+        return os.path.basename(value)
+    if operator == "d":
+        return os.path.dirname(value)
+    if operator == "l":
+        return rest
+    if operator.startswith("="):
+        length = _number(operator[1:])
+        return value[:length] if length >= 0 else value[length:]
+    return value
+
+
+def expand_conditional(content, variables):
+    """Expand content of #{?cond,a,b} or #{?cond1,a,cond2,b,c}."""
+    arguments = split_arguments(content[1:])
+    while len(arguments) >= 2:
+        condition, branch = arguments[:2]
+        if condition.startswith("#{"):
+            condition = expand(condition, variables)
+        else:
+            condition = variables.get(condition, "")
+        if is_true(condition):
+            return expand(branch, variables)
+        arguments = arguments[2:]
+    return expand(arguments[0], variables) if arguments else ""
+
+
+def sample_command_output(command):
+    """Return sample output of shell command in #(...)."""
+    for name, output in SAMPLE_COMMANDS.items():
+        if name in command:
+            return output
+    return ""
+
+
+def expand(value, variables):
+    """
+    Expand tmux format with sample variables.
+
+    Style blocks '#[...]' and '##' are kept for rendering.
+    """
+    pieces = []
+    index = 0
+    while index < len(value):
+        if value.startswith("##", index):
+            pieces.append("##")
+            index += 2
+        elif value.startswith("#,", index):
+            pieces.append(",")
+            index += 2
+        elif value.startswith(optimizer.STYLE_START, index):
+            end = value.find(optimizer.STYLE_END, index)
+            end = len(value) if end < 0 else end + 1
+            pieces.append(value[index:end].replace("#,", ","))
+            index = end
+        elif value.startswith("#{", index):
+            end = optimizer.skip_nested(value, index, "{", "}")
+            content = value[index + 2 : end - 1]
+            if content.startswith("?"):
+                pieces.append(expand_conditional(content, variables))
+            else:
+                pieces.append(expand_variable(content, variables))
+            index = end
+        elif value.startswith("#(", index):
+            end = optimizer.skip_nested(value, index, "(", ")")
+            pieces.append(sample_command_output(value[index + 2 : end - 1]))
+            index = end
+        elif value[index] == "#" and value[index + 1 : index + 2] in (
+            SHORT_VARIABLES
+        ):
+            name = SHORT_VARIABLES[value[index + 1]]
+            pieces.append(variables.get(name, ""))
+            index += 2
+        else:
+            pieces.append(value[index])
+            index += 1
+    return "".join(pieces)
+
+
+def apply_style(style, current, default):
+    """Return new style dict after applying tmux style string."""
+    current = dict(current)
+    for piece in style.replace(" ", ",").split(","):
+        piece = piece.strip()
+        key, separator, value = piece.partition("=")
+        if piece == "default":
+            current = dict(default)
+        elif separator and key in ("fg", "bg"):
+            current[key] = default[key] if value == "default" else value
+        elif piece == "none":
+            current["attributes"] = ()
+        elif piece.startswith("no") and piece[2:] in ATTRIBUTE_CODES:
+            current["attributes"] = tuple(
+                _attribute
+                for _attribute in current["attributes"]
+                if _attribute != piece[2:]
+            )
+        elif piece in ATTRIBUTE_CODES:
+            if piece not in current["attributes"]:
+                current["attributes"] += (piece,)
+        # others such as align, list and range don't change colors
+    return current
+
+
+def render(value, variables, default):
+    """
+    Render expanded format to segments.
+
+    Return:
+        A list of (style, text) tuples.
+    """
+    segments = []
+    current = dict(default)
+    for kind, text in optimizer.tokenize(expand(value, variables)):
+        if kind == optimizer.STYLE:
+            current = apply_style(text, current, default)
+        elif text:
+            segments.append((current, text.replace("##", "#")))
+    return segments
+
+
+def char_width(char):
+    """Return display width of character in terminal."""
+    if unicodedata.combining(char):
+        return 0
+    return 2 if unicodedata.east_asian_width(char) in ("W", "F") else 1
+
+
+def segments_width(segments):
+    """Return display width of segments."""
+    return sum(char_width(char) for _, text in segments for char in text)
+
+
+def truncate(segments, width):
+    """Return segments truncated to display width."""
+    truncated = []
+    for style, text in segments:
+        kept = []
+        for char in text:
+            width -= char_width(char)
+            if width < 0:
+                break
+            kept.append(char)
+        if kept:
+            truncated.append((style, "".join(kept)))
+        if width <= 0:
+            break
+    return truncated
+
+
+def color_code(value, background=False):
+    """Convert tmux color to SGR parameters. e.g. #ff7834 -> 38;2;255;120;52"""
+    base = 48 if background else 38
+    value = value.lower()
+    if re.match(r"^#[0-9a-f]{6}$", value):
+        red, green, blue = (int(value[i : i + 2], 16) for i in (1, 3, 5))
+        return f"{base};2;{red};{green};{blue}"
+    match = re.match(r"^colou?r(\d{1,3})$", value)
+    if match:
+        return f"{base};5;{match.group(1)}"
+    bright = value.startswith("bright")
+    name = value[len("bright") :] if bright else value
+    if name in NAMED_COLORS:
+        offset = (60 if bright else 0) + (10 if background else 0)
+        return str(30 + offset + NAMED_COLORS.index(name))
+    # default, terminal or unknown colors
+    return ""
+
+
+def sgr(style):
+    """Return SGR escape sequence of style dict."""
+    parameters = ["0"]
+    parameters.extend(
+        str(ATTRIBUTE_CODES[_attribute]) for _attribute in style["attributes"]
+    )
+    for key in ("fg", "bg"):
+        code = color_code(style.get(key) or "", background=key == "bg")
+        if code:
+            parameters.append(code)
+    return f"{CSI}{';'.join(parameters)}m"
+
+
+def to_ansi(segments):
+    """Convert segments to text with SGR escape sequences."""
+    pieces = []
+    last = None
+    for style, text in segments:
+        if style != last:
+            pieces.append(sgr(style))
+            last = style
+        pieces.append(text)
+    pieces.append(SGR_RESET)
+    return "".join(pieces)
+
+
+def parse_option_commands(option_commands):
+    """Return options set by the tmux commands of Constructor."""
+    options = {}
+    for command in ";".join(option_commands).split(";"):
+        match = REGEX_OPTION_COMMAND.match(command.strip())
+        if match:
+            options[match.group(1)] = match.group(2)
+    return options
+
+
+def render_status_line(options, width):
+    """Render status line as tmux draws it, with sample windows."""
+    default = apply_style(
+        options.get("status-style", ""),
+        {"fg": "", "bg": "", "attributes": ()},
+        {"fg": "", "bg": "", "attributes": ()},
+    )
+    variables = dict(SAMPLE_VARIABLES, client_width=str(width))
+
+    left = render(
+        time.strftime(options.get("status-left", ""), SAMPLE_TIME),
+        variables,
+        default,
+    )
+    left = truncate(
+        left, min(_number(options.get("status-left-length", "10")), width)
+    )
+    right = render(
+        time.strftime(options.get("status-right", ""), SAMPLE_TIME),
+        variables,
+        default,
+    )
+    right = truncate(
+        right,
+        min(
+            _number(options.get("status-right-length", "40")),
+            width - segments_width(left),
+        ),
+    )
+
+    windows = []
+    for index, name in enumerate(SAMPLE_WINDOWS):
+        active = index == SAMPLE_ACTIVE_WINDOW
+        window_variables = dict(
+            variables,
+            window_index=str(index),
+            window_name=name,
+            window_active="1" if active else "0",
+            window_flags="*" if active else "",
+        )
+        option = (
+            "window-status-current-format"
+            if active
+            else "window-status-format"
+        )
+        if windows:
+            windows.append(
+                (default, options.get("window-status-separator", " "))
+            )
+        windows.extend(
+            render(options.get(option, ""), window_variables, default)
+        )
+
+    windows = truncate(
+        windows,
+        max(width - segments_width(left) - segments_width(right), 0),
+    )
+    gap = width - sum(map(segments_width, (left, windows, right)))
+    return to_ansi(left + windows + [(default, " " * max(gap, 0))] + right)
+
+
+def preview_key(theme_file, eutmux, width):
+    """Return hash of everything the preview of theme depends on."""
+    digest = hashlib.sha256()
+    with open(theme_file, "rb") as theme:
+        digest.update(theme.read())
+    digest.update(json.dumps(eutmux, sort_keys=True, default=str).encode())
+    digest.update(f"{width}:{rendering_digest()}".encode())
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def rendering_digest():
+    """Return hash of sources of browser and the modules producing formats."""
+    digest = hashlib.sha256()
+    for name in RENDERING_MODULES:
+        with open(sys.modules[name].__file__, "rb") as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+def render_preview(theme_file, eutmux, width):
+    """Render status line preview of theme. Run in worker process."""
+    try:
+        with open(theme_file, "r", encoding=UTF_8) as theme:
+            constructor = Constructor(
+                eutmux, Theme.resolve(yaml.safe_load(theme))
+            )
+        options = parse_option_commands(constructor.produce_option_commands())
+        return True, render_status_line(options, width)
+    except Exception as error:  # pylint: disable=broad-except
+        # one broken theme doesn't break the browser
+        message = str(error).splitlines()[0] if str(error) else repr(error)
+        return False, f"{CSI}31m{message[:width]}{SGR_RESET}"
+
+
+def read_preview(preview_file):
+    """Return cached preview, or None if it's not cached."""
+    try:
+        with open(preview_file, "r", encoding=UTF_8) as preview:
+            return preview.read()
+    except OSError:
+        return None
+
+
+def write_preview(preview_file, preview):
+    """Write preview into cache atomically."""
+    try:
+        atomic_write(preview_file, preview)
+    except OSError:
+        # preview is rendered again next time
+        pass
+
+
+class Browser:
+    """Full screen theme list with previews, driven by keys."""
+
+    KEYS_UP = ("k", f"{CSI}A", "\033OA")
+    KEYS_DOWN = ("j", f"{CSI}B", "\033OB")
+    KEYS_PAGE_UP = (f"{CSI}5~", "\x02")
+    KEYS_PAGE_DOWN = (f"{CSI}6~", "\x06", " ")
+    KEYS_APPLY = ("\r", "\n")
+    KEYS_QUIT = ("q", "\033", "\x03")
+    # each theme takes name line and preview line
+    LINES_PER_THEME = 2
+
+    def __init__(self, theme_names, previews, columns, rows, selected=0):
+        """Constructor."""
+        self.theme_names = theme_names
+        self.previews = previews
+        self.columns = columns
+        self.rows = rows
+        self.selected = selected
+        self.top = 0
+
+    @property
+    def page_size(self):
+        """Return the number of themes in one screen."""
+        return max((self.rows - 1) // self.LINES_PER_THEME, 1)
+
+    def move(self, offset):
+        """Move selection and scroll to keep it visible."""
+        self.selected = min(
+            max(self.selected + offset, 0), len(self.theme_names) - 1
+        )
+        if self.selected < self.top:
+            self.top = self.selected
+        elif self.selected >= self.top + self.page_size:
+            self.top = self.selected - self.page_size + 1
+
+    def handle_key(self, key):
+        """
+        Handle key press.
+
+        Return:
+            True to apply the selected theme, False to quit, or None to
+            continue browsing.
+        """
+        if key in self.KEYS_UP:
+            self.move(-1)
+        elif key in self.KEYS_DOWN:
+            self.move(1)
+        elif key in self.KEYS_PAGE_UP:
+            self.move(-self.page_size)
+        elif key in self.KEYS_PAGE_DOWN:
+            self.move(self.page_size)
+        elif key == "g":
+            self.move(-len(self.theme_names))
+        elif key == "G":
+            self.move(len(self.theme_names))
+        elif key in self.KEYS_APPLY:
+            return True
+        elif key in self.KEYS_QUIT:
+            return False
+        return None
+
+    def draw(self):
+        """Return the whole screen content."""
+        lines = [
+            f"{CSI}1mThemes {self.selected + 1}/{len(self.theme_names)}"
+            f"{SGR_RESET}  j/k: move  Enter: apply  q: quit"
+        ]
+        for index in range(
+            self.top,
+            min(self.top + self.page_size, len(self.theme_names)),
+        ):
+            name = self.theme_names[index]
+            if index == self.selected:
+                lines.append(f"{CSI}7m> {name[:self.columns - 2]}{SGR_RESET}")
+            else:
+                lines.append(f"  {name[:self.columns - 2]}")
+            lines.append(self.previews.get(name) or f"{CSI}2m...{SGR_RESET}")
+        return f"{CSI}H{CSI}2J" + "\r\n".join(lines)
+
+
+def browse(theme_names):
+    """
+    Show the browser on the tty and return the chosen theme name.
+
+    Cached previews are shown at once, and missed ones are rendered in
+    worker processes and shown as soon as they are done. Nothing is
+    applied to tmux while browsing.
+    """
+    eutmux = load_config()
+    _, eutmux_cache_home = eutmux_homes()
+    preview_dir = os.path.join(eutmux_cache_home, "previews")
+    current = get_tmux_option("@eutmux_dynamic_theme_name", "")
+
+    with open("/dev/tty", "r+b", buffering=0) as tty_file:
+        fd = tty_file.fileno()
+        columns, rows = os.get_terminal_size(fd)
+        width = columns
+
+        previews = {}
+        pending = {}
+        executor = ProcessPoolExecutor()
+        for name in theme_names:
+            theme_file = find_theme_file(name)
+            preview_file = os.path.join(
+                preview_dir,
+                f"{preview_key(theme_file, eutmux, width)}{PREVIEW_EXTENSION}",
+            )
+            previews[name] = read_preview(preview_file)
+            if previews[name] is None:
+                future = executor.submit(
+                    render_preview, theme_file, eutmux, width
+                )
+                pending[future] = (name, preview_file)
+
+        browser = Browser(
+            theme_names,
+            previews,
+            columns,
+            rows,
+            theme_names.index(current) if current in theme_names else 0,
+        )
+        browser.move(0)
+
+        attributes = termios.tcgetattr(fd)
+        chosen = None
+        try:
+            tty.setcbreak(fd)
+            os.write(fd, f"{CSI}?1049h{CSI}?25l".encode())
+            changed = True
+            while chosen is None:
+                for future in [
+                    _future for _future in pending if _future.done()
+                ]:
+                    name, preview_file = pending.pop(future)
+                    ok, previews[name] = future.result()
+                    if ok:
+                        write_preview(preview_file, previews[name])
+                    changed = True
+                if changed:
+                    os.write(fd, browser.draw().encode(UTF_8))
+                    changed = False
+                readable, _, _ = select.select(
+                    [fd], [], [], 0.1 if pending else None
+                )
+                if readable:
+                    chosen = browser.handle_key(os.read(fd, 32).decode())
+                    changed = True
+        except KeyboardInterrupt:
+            chosen = False
+        finally:
+            os.write(fd, f"{CSI}?25h{CSI}?1049l".encode())
+            termios.tcsetattr(fd, termios.TCSADRAIN, attributes)
+            executor.shutdown(wait=False, cancel_futures=True)
+    return theme_names[browser.selected] if chosen else None
+
+
+def main():
+    """Run."""
+    theme_names = sys.argv[1:]
+    if not theme_names:
+        return
+    chosen = browse(theme_names)
+    if chosen:
+        print(chosen)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,20 @@
 #!/usr/bin/env python3
 """Provide utility functions for Tmux option reading and writing."""
 import os
+import shlex
+from types import MappingProxyType
 
 import yaml
 from peelee import color
 
-from utils import get_tmux_option, run_shell_command
+import optimizer
+import terminal
+from utils import (
+    atomic_write,
+    cache_home,
+    get_tmux_option,
+    run_shell_command,
+)
 
 UTF_8 = "utf-8"
 EMPTY = ""
@@ -14,6 +23,24 @@ EMPTY = ""
 STYLE_START = "#["
 STYLE_END = "]"
 
+# modes to apply theme terminal colors to panes
+TERMINAL_COLORS_OFF = "off"
+TERMINAL_COLORS_STYLE = "style"
+TERMINAL_COLORS_OSC = "osc"
+# OSC sequences of the last apply, written to new panes by tmux hooks
+TERMINAL_SEQUENCES_FILENAME = "terminal_sequences"
+TERMINAL_HOOKS = (
+    "after-new-session",
+    "after-new-window",
+    "after-split-window",
+)
+# hooks are set at this index, so that hooks of user are kept
+TERMINAL_HOOK_INDEX = 90
+# markers of what the last apply changed, so that they are reset when mode
+# of terminal colors is switched
+WINDOW_STYLE_APPLIED = "@eutmux_window_style_applied"
+TERMINAL_SEQUENCES_APPLIED = "@eutmux_terminal_sequences_applied"
+
 
 def get(_dict, key, default):
     """
@@ -32,196 +59,689 @@ def get(_dict, key, default):
     return value
 
 
-class Theme(dict):
-    """Wrapper for theme configuration."""
+def is_on(value):
+    """
+    Return True if value of switch option is on.
 
-    def __init__(self, theme_config: dict):
-        self.terminal = theme_config.get("terminal")
-        self.status_line = theme_config.get("status_line")
-        self.status_left = ThemeStatusLeft(theme_config)
-        self.active_window = ThemeWindow(
-            self.status_line, theme_config.get("window").get("active")
-        )
-        self.inactive_window = ThemeWindow(
-            self.status_line, theme_config.get("window").get("inactive")
+    YAML gives True for true and on, and Tmux style "on" or "true" strings
+    are accepted as well.
+    """
+    return value is True or str(value).strip().lower() in ("on", "true")
+
+
+class ConfigError(ValueError):
+    """Raised when theme or configuration file has invalid keys or values."""
+
+
+# layers a resolved value could come from, from lowest to highest priority.
+LAYER_DEFAULT = "default"
+LAYER_STATUS_LINE = "status_line"
+LAYER_THEME = "theme"
+LAYER_THEME_COMPONENT = "theme_component"
+LAYER_CONFIG = "config"
+
+TERMINAL_KEYS = ("foreground", "background")
+STATUS_LINE_KEYS = (
+    "foreground",
+    "background",
+    "left_icon",
+    "right_icon",
+    "left_decorator",
+    "right_decorator",
+    "fg_format",
+    "bg_format",
+    "fg_icon",
+    "bg_icon",
+    "fg_decorator",
+    "bg_decorator",
+    "style",
+)
+REQUIRED_STATUS_LINE_KEYS = ("foreground", "background")
+# sections of configuration file which must be mappings if they are given
+CONFIG_SECTIONS = (
+    "terminal",
+    "status_line",
+    "general",
+    "status_left",
+    "window",
+    "status_right",
+)
+
+# theme section key -> (status_line key to fall back to, whether None or
+# blank value in theme section falls back as well)
+STATUS_LEFT_FALLBACKS = {
+    "fg_format": ("foreground", True),
+    "bg_format": ("background", True),
+    "fg_icon": ("foreground", True),
+    "bg_icon": ("background", True),
+    "fg_decorator": ("foreground", False),
+    "bg_decorator": ("background", True),
+    "icon": ("left_icon", True),
+    "decorator": ("left_decorator", False),
+    "style": ("style", True),
+}
+WINDOW_FALLBACKS = {
+    "fg_window": ("foreground", True),
+    "bg_window": ("background", True),
+    "fg_window_index": ("foreground", True),
+    "bg_window_index": ("background", True),
+    "fg_icon": ("foreground", True),
+    "bg_icon": ("background", True),
+    "fg_decorator": ("foreground", True),
+    "bg_decorator": ("background", True),
+    "icon": ("left_icon", True),
+    "decorator": ("left_decorator", True),
+    "style": ("style", True),
+}
+STATUS_RIGHT_FALLBACKS = {
+    "fg_format": ("foreground", True),
+    "bg_format": ("background", True),
+    "fg_icon": ("foreground", True),
+    "bg_icon": ("background", True),
+    "fg_decorator": ("foreground", True),
+    "bg_decorator": ("background", True),
+    "icon": ("left_icon", True),
+    "decorator": ("left_decorator", True),
+    "style": ("style", True),
+}
+
+STATUS_COMPONENT_KEYS = (
+    "enabled",
+    "format",
+    "icon",
+    "decorator",
+    "fg_format",
+    "bg_format",
+    "fg_icon",
+    "bg_icon",
+    "fg_decorator",
+    "bg_decorator",
+    "style",
+    "hide_empty",
+)
+# window components accept all keys of status components as well
+WINDOW_COMPONENT_KEYS = STATUS_COMPONENT_KEYS + (
+    "window_name",
+    "window_index",
+    "fg_window",
+    "bg_window",
+    "fg_window_index",
+    "bg_window_index",
+)
+STYLE_KEYS = ("fg", "bg", "style")
+
+# compact window format is used for inactive windows when there are too many
+# windows. it's resolved against inactive window section of theme.
+COMPACT_WINDOW = "compact"
+COMPACT_WINDOW_INDEX = " #I "
+WINDOW_LIMITS_KEYS = ("max_windows", "max_width", "window_width", "neighbours")
+COMPACT_WINDOW_KEYS = WINDOW_COMPONENT_KEYS + WINDOW_LIMITS_KEYS
+
+
+def _check_section(errors, path, section, allowed_keys, nested=False):
+    """Collect errors of unknown keys or non-string values in section."""
+    if section is None:
+        return
+    if not isinstance(section, dict):
+        errors.append(f"{path}: expected a mapping, got {section!r}")
+        return
+    for key, value in section.items():
+        if nested and isinstance(value, dict):
+            _check_section(errors, f"{path}.{key}", value, allowed_keys)
+        elif key not in allowed_keys:
+            errors.append(f"{path}.{key}: unknown key")
+        elif key in ("enabled", "hide_empty"):
+            if not isinstance(value, (bool, str)) and value is not None:
+                errors.append(
+                    f"{path}.{key}: expected a switch, got {value!r}"
+                )
+        elif key in WINDOW_LIMITS_KEYS:
+            if (
+                not isinstance(value, int)
+                or isinstance(value, bool)
+                or value < 0
+            ) and value is not None:
+                errors.append(
+                    f"{path}.{key}: expected a non-negative integer, "
+                    f"got {value!r}"
+                )
+        elif not isinstance(value, str) and value is not None:
+            errors.append(f"{path}.{key}: expected a string, got {value!r}")
+
+
+def _components(config, section_name):
+    """Return (name, component) pairs of section, empty component as {}."""
+    section = config.get(section_name) or {}
+    return [(name, component or {}) for name, component in section.items()]
+
+
+def _raise_errors(source, errors):
+    """Raise ConfigError with all collected errors if there is any."""
+    if errors:
+        details = "\n  ".join(errors)
+        raise ConfigError(f"Invalid {source}:\n  {details}")
+
+
+class Record:
+    """
+    Immutable record of resolved values.
+
+    Each value is resolved once from the layers of status_line defaults,
+    theme sections and user configuration. The layer each value came
+    from is kept in 'origins' so that it's easy to tell why a value is
+    used.
+    """
+
+    __slots__ = ("origins",)
+
+    _field_names = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._field_names = cls._field_names + cls.__dict__.get("__slots__", ())
+
+    def __init__(self, values: dict, origins: dict = None):
+        for name in self._field_names:
+            object.__setattr__(self, name, values.get(name))
+        object.__setattr__(self, "origins", MappingProxyType(origins or {}))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable.")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable.")
+
+    def __repr__(self):
+        values = ", ".join(
+            f"{name}={getattr(self, name)!r}" for name in self._field_names
         )
-        self.window = {
-            "active": self.active_window,
-            "inactive": self.inactive_window,
-        }
-        self.status_right = ThemeStatusRight(theme_config)
-        super().__init__(
-            terminal=self.terminal,
-            status_line=self.status_line,
-            status_left=self.status_left,
-            window=self.window,
-            status_right=self.status_right,
+        return f"{type(self).__name__}({values})"
+
+    def origin(self, name):
+        """Return the layer where the value of the given name came from."""
+        return self.origins.get(name, LAYER_DEFAULT)
+
+    def replace(self, values: dict, layer: str = None):
+        """
+        Return new record with the given values replaced.
+
+        Replaced values keep their origins if layer is not given.
+        """
+        origins = dict(self.origins)
+        if layer is not None:
+            origins.update({key: layer for key in values})
+        return type(self)(
+            {
+                **{key: getattr(self, key) for key in self._field_names},
+                **values,
+            },
+            origins,
         )
 
 
-class ThemeStatusLeft(dict):
-    """Wrapper for status_left configuration."""
+class ThemeSection(Record):
+    """Resolved theme section: status_left, window or status_right."""
 
-    def __init__(self, theme_config):
-        """Constructor."""
+    COLORS = (
+        "fg_format",
+        "bg_format",
+        "fg_window",
+        "bg_window",
+        "fg_window_index",
+        "bg_window_index",
+        "fg_icon",
+        "bg_icon",
+        "fg_decorator",
+        "bg_decorator",
+    )
+
+    __slots__ = (
+        "fg_format",
+        "bg_format",
+        "fg_window",
+        "bg_window",
+        "fg_window_index",
+        "bg_window_index",
+        "fg_icon",
+        "bg_icon",
+        "fg_decorator",
+        "bg_decorator",
+        "icon",
+        "decorator",
+        "style",
+    )
+
+    @classmethod
+    def resolve(cls, status_line, section, fallbacks):
+        """Resolve theme section values against status_line defaults."""
+        values = {}
+        origins = {}
+        for key, (fallback_key, blank_falls_back) in fallbacks.items():
+            if blank_falls_back:
+                value = get(section, key, None)
+                missing = value is None
+            else:
+                value = section.get(key)
+                missing = key not in section
+            origins[key] = LAYER_THEME
+            if missing:
+                value = status_line.get(fallback_key)
+                origins[key] = LAYER_STATUS_LINE
+            values[key] = value
+        return cls(values, origins)
+
+    def override(self, section):
+        """Return new section with values overridden by the given section."""
+        values = {}
+        for key in self._field_names:
+            value = get(section, key, None)
+            if value is not None:
+                values[key] = value
+        return self.replace(values, LAYER_THEME_COMPONENT)
+
+
+class Theme(Record):
+    """Wrapper for theme configuration."""
+
+    __slots__ = (
+        "terminal",
+        "status_line",
+        "status_left",
+        "window",
+        "status_right",
+        "status_left_components",
+        "status_right_components",
+    )
+
+    @classmethod
+    def resolve(cls, theme_config: dict):
+        """Resolve theme sections and their component overrides."""
+        cls.validate(theme_config)
         status_line = theme_config.get("status_line")
         status_left = theme_config.get("status_left")
-        self.fg_format = get(
-            status_left, "fg_format", status_line.get("foreground")
-        )
-        self.bg_format = get(
-            status_left, "bg_format", status_line.get("background")
-        )
-        self.fg_format = color.convert_to_best_light_color(
-            self.fg_format, self.bg_format
+        status_right = theme_config.get("status_right")
+        window = theme_config.get("window")
+
+        status_left_section = ThemeSection.resolve(
+            status_line, status_left, STATUS_LEFT_FALLBACKS
         )
-        self.fg_icon = get(
-            status_left, "fg_icon", status_line.get("foreground")
+        # text in status left is always lighter than its background
+        fg_format = color.convert_to_best_light_color(
+            status_left_section.fg_format, status_left_section.bg_format
         )
-        self.bg_icon = get(
-            status_left, "bg_icon", status_line.get("background")
+        status_left_section = status_left_section.replace(
+            {"fg_format": fg_format}
         )
-        self.fg_decorator = status_left.get(
-            "fg_decorator", status_line.get("foreground")
+        status_right_section = ThemeSection.resolve(
+            status_line, status_right, STATUS_RIGHT_FALLBACKS
         )
-        self.bg_decorator = get(
-            status_left, "bg_decorator", status_line.get("background")
+        return cls(
+            {
+                "terminal": MappingProxyType(
+                    theme_config.get("terminal") or {}
+                ),
+                "status_line": MappingProxyType(status_line),
+                "status_left": status_left_section,
+                "window": MappingProxyType(
+                    {
+                        name: ThemeSection.resolve(
+                            status_line, section, WINDOW_FALLBACKS
+                        )
+                        for name, section in window.items()
+                    }
+                ),
+                "status_right": status_right_section,
+                "status_left_components": cls._components(
+                    status_left_section, status_left
+                ),
+                "status_right_components": cls._components(
+                    status_right_section, status_right
+                ),
+            }
         )
-        self.icon = get(status_left, "icon", status_line.get("left_icon"))
-        self.decorator = status_left.get(
-            "decorator", status_line.get("left_decorator")
+
+    @staticmethod
+    def _components(section_record, section):
+        """Resolve component specific overrides in theme section."""
+        return MappingProxyType(
+            {
+                name: section_record.override(component)
+                for name, component in section.items()
+                if isinstance(component, dict)
+            }
         )
-        self.style = get(status_left, "style", status_line.get("style"))
-        super().__init__(
-            fg_format=self.fg_format,
-            bg_format=self.bg_format,
-            fg_icon=self.fg_icon,
-            bg_icon=self.bg_icon,
-            fg_decorator=self.fg_decorator,
-            bg_decorator=self.bg_decorator,
-            icon=self.icon,
-            decorator=self.decorator,
-            style=self.style,
+
+    @staticmethod
+    def validate(theme_config):
+        """Raise ConfigError if any required key is missing or mistyped."""
+        errors = []
+        if not isinstance(theme_config, dict):
+            _raise_errors(
+                "theme", [f"expected a mapping, got {theme_config!r}"]
+            )
+        _check_section(
+            errors, "terminal", theme_config.get("terminal"), TERMINAL_KEYS
         )
+        status_line = theme_config.get("status_line")
+        if status_line is None:
+            errors.append("status_line: missing")
+        else:
+            _check_section(
+                errors, "status_line", status_line, STATUS_LINE_KEYS
+            )
+            if isinstance(status_line, dict):
+                for key in REQUIRED_STATUS_LINE_KEYS:
+                    if not status_line.get(key):
+                        errors.append(f"status_line.{key}: missing")
+        for name, fallbacks in (
+            ("status_left", STATUS_LEFT_FALLBACKS),
+            ("status_right", STATUS_RIGHT_FALLBACKS),
+        ):
+            if theme_config.get(name) is None:
+                errors.append(f"{name}: missing")
+            _check_section(
+                errors, name, theme_config.get(name), fallbacks, nested=True
+            )
+        window = theme_config.get("window")
+        if not isinstance(window, dict):
+            errors.append(f"window: expected a mapping, got {window!r}")
+        else:
+            for name in ("active", "inactive"):
+                if window.get(name) is None:
+                    errors.append(f"window.{name}: missing")
+            for name, section in window.items():
+                _check_section(
+                    errors, f"window.{name}", section, WINDOW_FALLBACKS
+                )
+        _raise_errors("theme", errors)
 
 
-class ThemeWindow(dict):
-    """Wrapper for window configuration."""
+class Component(Record):
+    """Resolved component of status left, window or status right."""
 
-    def __init__(self, status_line_theme_config, window_theme_config):
-        """Constructor."""
-        self.fg_window = get(
-            window_theme_config,
-            "fg_window",
-            status_line_theme_config.get("foreground"),
-        )
-        self.bg_window = get(
-            window_theme_config,
-            "bg_window",
-            status_line_theme_config.get("background"),
-        )
-        self.fg_window_index = get(
-            window_theme_config,
-            "fg_window_index",
-            status_line_theme_config.get("foreground"),
-        )
-        self.bg_window_index = get(
-            window_theme_config,
-            "bg_window_index",
-            status_line_theme_config.get("background"),
-        )
-        self.fg_icon = get(
-            window_theme_config,
-            "fg_icon",
-            status_line_theme_config.get("foreground"),
-        )
-        self.bg_icon = get(
-            window_theme_config,
-            "bg_icon",
-            status_line_theme_config.get("background"),
-        )
-        self.fg_decorator = get(
-            window_theme_config,
-            "fg_decorator",
-            status_line_theme_config.get("foreground"),
-        )
-        self.bg_decorator = get(
-            window_theme_config,
-            "bg_decorator",
-            status_line_theme_config.get("background"),
-        )
-        self.icon = get(
-            window_theme_config,
-            "icon",
-            status_line_theme_config.get("left_icon"),
-        )
-        self.decorator = get(
-            window_theme_config,
-            "decorator",
-            status_line_theme_config.get("left_decorator"),
-        )
-        self.style = get(
-            window_theme_config, "style", status_line_theme_config.get("style")
-        )
-        super().__init__(
-            fg_window=self.fg_window,
-            bg_window=self.bg_window,
-            fg_window_index=self.fg_window_index,
-            bg_window_index=self.bg_window_index,
-            fg_icon=self.fg_icon,
-            bg_icon=self.bg_icon,
-            fg_decorator=self.fg_decorator,
-            bg_decorator=self.bg_decorator,
-            icon=self.icon,
-            decorator=self.decorator,
-            style=self.style,
-        )
+    __slots__ = (
+        "name",
+        "format",
+        "window_name",
+        "window_index",
+        "icon",
+        "decorator",
+        "fg_format",
+        "bg_format",
+        "fg_window",
+        "bg_window",
+        "fg_window_index",
+        "bg_window_index",
+        "fg_icon",
+        "bg_icon",
+        "fg_decorator",
+        "bg_decorator",
+        "style",
+        "hide_empty",
+    )
 
+    @classmethod
+    def resolve(cls, name, component, section):
+        """
+        Resolve component configuration against theme section.
 
-class ThemeStatusRight(dict):
-    """Wrapper for status_right configuration."""
+        Unlike theme configuration, user configuration overrides theme
+        configuration even if the value is Empty. For example, if theme
+        defined icons, but user don't want to use icon, then they can set
+        icon as Empty.
+        """
+        values = {"name": name}
+        origins = {"name": LAYER_CONFIG}
+        for key in cls._field_names:
+            if key == "name":
+                continue
+            if key in component:
+                values[key] = component.get(key)
+                origins[key] = LAYER_CONFIG
+            elif key in ThemeSection._field_names:
+                values[key] = getattr(section, key)
+                origins[key] = section.origin(key)
+        return cls(values, origins)
 
-    def __init__(self, theme_config):
-        """Constructor."""
-        status_line = theme_config.get("status_line")
-        status_right = theme_config.get("status_right")
-        self.fg_format = get(
-            status_right, "fg_format", status_line.get("foreground")
-        )
-        self.bg_format = get(
-            status_right, "bg_format", status_line.get("background")
-        )
-        self.bg_foramt = color.convert_to_best_dark_color(
-            self.bg_format, self.fg_format
-        )
-        self.fg_icon = get(
-            status_right, "fg_icon", status_line.get("foreground")
-        )
-        self.bg_icon = get(
-            status_right, "bg_icon", status_line.get("background")
-        )
-        self.fg_decorator = get(
-            status_right, "fg_decorator", status_line.get("foreground")
+
+class Style(Record):
+    """Resolved general style option such as message-style."""
+
+    __slots__ = ("name", "fg", "bg", "style")
+
+
+class WindowLimits(Record):
+    """
+    Limits to use compact format for inactive windows.
+
+    Compact format is used when there are more than max_windows windows,
+    or when windows with estimated window_width would take more than
+    max_width percent of client width. Windows within neighbours of the
+    active window always use full format.
+    """
+
+    __slots__ = WINDOW_LIMITS_KEYS
+
+    DEFAULTS = {
+        "max_windows": 20,
+        "max_width": 60,
+        "window_width": None,
+        "neighbours": 1,
+    }
+
+    @classmethod
+    def resolve(cls, component):
+        """Resolve limits from compact window configuration."""
+        values = {}
+        origins = {}
+        for key, default in cls.DEFAULTS.items():
+            values[key] = component.get(key, default)
+            origins[key] = LAYER_CONFIG if key in component else LAYER_DEFAULT
+        return cls(values, origins)
+
+
+class Layout(Record):
+    """
+    All resolved configurations to produce tmux commands.
+
+    Disabled components are dropped while resolving, then producing
+    tmux options is a straight pass over the records.
+    """
+
+    __slots__ = (
+        "terminal",
+        "status_line",
+        "styles",
+        "status_left",
+        "window",
+        "window_limits",
+        "status_right",
+    )
+
+    @classmethod
+    def resolve(cls, eutmux: dict, theme: Theme):
+        """Merge theme and user configuration into one layout."""
+        cls.validate(eutmux, theme)
+        terminal = {**theme.terminal, **(eutmux.get("terminal") or {})}
+        status_line = {
+            **theme.status_line,
+            **(eutmux.get("status_line") or {}),
+        }
+        general = eutmux.get("general") or {}
+
+        styles = []
+        for name, component in (general.get("styles") or {}).items():
+            if name == "option-commands":
+                continue
+            values = {
+                "name": name,
+                "fg": component.get("fg", terminal.get("foreground")),
+                "bg": component.get("bg", terminal.get("background")),
+                "style": component.get("style", status_line.get("style")),
+            }
+            origins = {
+                key: LAYER_CONFIG if key in component else LAYER_THEME
+                for key in STYLE_KEYS
+            }
+            styles.append(Style(values, origins))
+
+        def components(section_name, theme_section, theme_components):
+            return tuple(
+                Component.resolve(
+                    name,
+                    component,
+                    theme_components.get(name, theme_section),
+                )
+                for name, component in _components(eutmux, section_name)
+                if is_on(component.get("enabled", True))
+            )
+
+        return cls(
+            {
+                "terminal": MappingProxyType(terminal),
+                "status_line": MappingProxyType(status_line),
+                "styles": tuple(styles),
+                "status_left": components(
+                    "status_left",
+                    theme.status_left,
+                    theme.status_left_components,
+                ),
+                "window": tuple(
+                    Component.resolve(
+                        name,
+                        (
+                            {"window_index": COMPACT_WINDOW_INDEX, **component}
+                            if name == COMPACT_WINDOW
+                            else component
+                        ),
+                        theme.window.get(name, theme.window["inactive"]),
+                    )
+                    for name, component in _components(eutmux, "window")
+                    if name != COMPACT_WINDOW
+                    or is_on(component.get("enabled", True))
+                ),
+                "window_limits": WindowLimits.resolve(
+                    dict(_components(eutmux, "window")).get(COMPACT_WINDOW, {})
+                ),
+                "status_right": components(
+                    "status_right",
+                    theme.status_right,
+                    theme.status_right_components,
+                ),
+            }
         )
-        self.bg_decorator = get(
-            status_right, "bg_decorator", status_line.get("background")
+
+    @staticmethod
+    def validate(eutmux, theme):
+        """Raise ConfigError if any configured key is unknown or mistyped."""
+        if not isinstance(eutmux, dict):
+            _raise_errors(
+                "configuration", [f"expected a mapping, got {eutmux!r}"]
+            )
+        # sections are walked below, so their types are checked first
+        _raise_errors(
+            "configuration",
+            [
+                f"{name}: expected a mapping, got {eutmux[name]!r}"
+                for name in CONFIG_SECTIONS
+                if eutmux.get(name) is not None
+                and not isinstance(eutmux[name], dict)
+            ],
         )
-        self.icon = get(status_right, "icon", status_line.get("left_icon"))
-        self.decorator = get(
-            status_right, "decorator", status_line.get("left_decorator")
+        errors = []
+        _check_section(
+            errors, "terminal", eutmux.get("terminal"), TERMINAL_KEYS
         )
-        self.style = get(status_right, "style", status_line.get("style"))
-        super().__init__(
-            fg_format=self.fg_format,
-            bg_format=self.bg_format,
-            fg_icon=self.fg_icon,
-            bg_icon=self.bg_icon,
-            fg_decorator=self.fg_decorator,
-            bg_decorator=self.bg_decorator,
-            icon=self.icon,
-            decorator=self.decorator,
-            style=self.style,
+        _check_section(
+            errors, "status_line", eutmux.get("status_line"), STATUS_LINE_KEYS
         )
+        Layout.validate_general(errors, eutmux.get("general") or {})
+        for section_name in ("status_left", "status_right"):
+            for name, component in _components(eutmux, section_name):
+                _check_section(
+                    errors,
+                    f"{section_name}.{name}",
+                    component,
+                    STATUS_COMPONENT_KEYS,
+                )
+        window = eutmux.get("window") or {}
+        for name in ("active", "inactive"):
+            if window.get(name) is None:
+                errors.append(f"window.{name}: missing")
+        window_names = (*theme.window, COMPACT_WINDOW)
+        for name, component in _components(eutmux, "window"):
+            if name not in window_names:
+                errors.append(
+                    f"window.{name}: unknown window, expected one of "
+                    f"{', '.join(window_names)}"
+                )
+            allowed_keys = (
+                COMPACT_WINDOW_KEYS
+                if name == COMPACT_WINDOW
+                else WINDOW_COMPONENT_KEYS
+            )
+            _check_section(errors, f"window.{name}", component, allowed_keys)
+        _raise_errors("configuration", errors)
+
+    @staticmethod
+    def validate_general(errors, general):
+        """Collect errors of options, styles and commands in general."""
+        options = general.get("options")
+        if options is not None and not isinstance(options, dict):
+            errors.append(
+                f"general.options: expected a mapping, got {options!r}"
+            )
+        elif options:
+            for name, value in options.items():
+                if isinstance(value, (dict, list)):
+                    errors.append(
+                        f"general.options.{name}: expected a simple value, "
+                        f"got {value!r}"
+                    )
+        styles = general.get("styles")
+        if styles is not None and not isinstance(styles, dict):
+            errors.append(
+                f"general.styles: expected a mapping, got {styles!r}"
+            )
+        elif styles:
+            for name, component in styles.items():
+                if name != "option-commands":
+                    _check_section(
+                        errors, f"general.styles.{name}", component, STYLE_KEYS
+                    )
+        commands = general.get("commands")
+        if commands is not None and not (
+            isinstance(commands, list)
+            and all(isinstance(command, str) for command in commands)
+        ):
+            errors.append(
+                "general.commands: expected a list of commands, "
+                f"got {commands!r}"
+            )
+
+
+def tmux_format(operator, *arguments):
+    """Return tmux format such as #{e|+:1,2} or #{?cond,a,b}."""
+    separator = "" if operator == "?" else ":"
+    return f"#{{{operator}{separator}{','.join(arguments)}}}"
+
+
+# estimated width of window name (#W) and window index (#I)
+WINDOW_NAME_WIDTH = 10
+WINDOW_INDEX_WIDTH = 2
+
+
+def estimate_width(value):
+    """Estimate display width of window format."""
+    text = "".join(
+        piece
+        for kind, piece in optimizer.tokenize(value)
+        if kind == optimizer.TEXT
+    )
+    width = len(text)
+    width += text.count("#W") * (WINDOW_NAME_WIDTH - 2)
+    width += text.count("#I") * (WINDOW_INDEX_WIDTH - 2)
+    return width
 
 
 class Constructor:
@@ -229,37 +749,29 @@ class Constructor:
 
     def __init__(self, eutmux: dict, theme: Theme):
         """Constructor."""
-        self.general = eutmux.get("general")
-        self.terminal = eutmux.get("terminal", theme.get("terminal"))
-        self.status_line = eutmux.get("status_line", theme.get("status_line"))
+        self.layout = Layout.resolve(eutmux, theme)
+        self.general = eutmux.get("general") or {}
+        self.terminal = self.layout.terminal
+        self.status_line = self.layout.status_line
         self.foreground = self.status_line.get("foreground")
         self.background = self.status_line.get("background")
-        self.status_left = eutmux.get("status_left")
-        self.window = eutmux.get("window")
-        self.status_right = eutmux.get("status_right")
-        self.theme = theme
 
     def produce_general_options_commands(self):
         """Produce general options."""
         general = []
-        for name, value in self.general.get("options").items():
+        for name, value in (self.general.get("options") or {}).items():
             if name.startswith("_"):
                 name = f"@{name.lstrip('_')}"
             general.append(f"set-option -gq {name} '{value}'")
 
-        for name, component in self.general.get("styles").items():
-            if name == "option-commands":
-                continue
-            foreground = component.get("fg", self.terminal.get("foreground"))
-            background = component.get("bg", self.terminal.get("background"))
-            style = component.get("style", self.status_line.get("style"))
+        for style in self.layout.styles:
             style_command = self.get_style_command(
-                foreground, background, style, name
+                style.fg, style.bg, style.style, style.name
             )
             if style_command is not None:
                 general.append(style_command)
 
-        for command in self.general.get("commands"):
+        for command in self.general.get("commands") or []:
             general.append(command)
         return ";".join(general)
 
@@ -269,152 +781,159 @@ class Constructor:
         bg_status_line = self.background
         return f"fg={fg_status_line},bg={bg_status_line}"
 
-    def produce_status_left(self):
-        """Produce status left option string."""
-        status_left = []
-        for component in self.status_left.values():
-            enabled = component.get("enabled", "on")
-            if not enabled:
-                continue
-            icon = component.get("icon", self.theme.status_left.get("icon"))
-            decorator = component.get(
-                "decorator", self.theme.status_left.get("decorator")
-            )
-            fg_format = component.get(
-                "fg_format", self.theme.status_left.get("fg_format")
-            )
-            bg_format = component.get(
-                "bg_format", self.theme.status_left.get("bg_format")
-            )
-            fg_icon = component.get(
-                "fg_icon", self.theme.status_left.get("fg_icon")
-            )
-            bg_icon = component.get(
-                "bg_icon", self.theme.status_left.get("bg_icon")
-            )
-            fg_decorator = component.get(
-                "fg_decorator", self.theme.status_left.get("fg_decorator")
-            )
-            bg_decorator = component.get(
-                "bg_decorator", self.theme.status_left.get("bg_decorator")
-            )
-            style = component.get("style", self.theme.status_left.get("style"))
-            _format = component.get("format", EMPTY)
-            format_style = f"{self.get_style_for_option(fg_format, bg_format, style, _format)}"
-            icon_style = (
-                f"{self.get_style_for_option(fg_icon, bg_icon, style, icon)}"
+    def produce_piece(self, component, piece, attribute=None):
+        """
+        Produce style string of one piece of component.
+
+        Parameters:
+            component: The resolved component.
+            piece: The piece name which decides colors to use. e.g. icon
+            attribute: The attribute of component to display. By default,
+            it's same with piece name. e.g. window_name for window piece.
+        """
+        return self.get_style_for_option(
+            getattr(component, f"fg_{piece}"),
+            getattr(component, f"bg_{piece}"),
+            component.style,
+            getattr(component, attribute or piece),
+        )
+
+    def produce_segments(self, section_name, pieces, optimize=False):
+        """
+        Join pieces of each component into segments separated by space.
+
+        A component with hide_empty on is wrapped in tmux conditional
+        format together with its separator, so that the whole segment
+        disappears when its format is expanded to blank, e.g. git status
+        outside a repository. With optimize, such segment is minimized on
+        its own, since the conditional is a barrier for the optimizer of
+        the whole format.
+        """
+        segments = []
+        for component in getattr(self.layout, section_name):
+            segment = " " if segments else EMPTY
+            segment += "".join(
+                self.produce_piece(component, piece) for piece in pieces
             )
-            decorator_style = f"{self.get_style_for_option(fg_decorator, bg_decorator, style, decorator)}"
-            component_value = f"{icon_style}{decorator_style}{format_style}"
-            status_left.append(component_value)
+            if is_on(component.hide_empty):
+                if optimizer.has_command_commas(component.format or EMPTY):
+                    path = f"{section_name}.{component.name}"
+                    _raise_errors(
+                        "configuration",
+                        [
+                            f"{path}: commas in shell command #(...) are "
+                            "not supported with hide_empty"
+                        ],
+                    )
+                content = optimizer.escape_commas(
+                    (component.format or EMPTY).strip()
+                )
+                if optimize:
+                    segment = optimizer.optimize(segment)
+                segment = tmux_format(
+                    "?",
+                    tmux_format("!=", content, EMPTY),
+                    optimizer.escape_commas(segment),
+                    EMPTY,
+                )
+            segments.append(segment)
+        return "".join(segments)
 
-        return " ".join(status_left)
+    def produce_status_left(self, optimize=False):
+        """Produce status left option string."""
+        return self.produce_segments(
+            "status_left", ("icon", "decorator", "format"), optimize
+        )
 
     def produce_window(self):
         """Return tuple with active window and inactive window option strings."""
-        windows = {}
-        for name, component in self.window.items():
-            style = component.get(
-                "style", self.theme.window.get(name).get("style")
-            )
-            icon = component.get(
-                "icon", self.theme.window.get(name).get("icon")
-            )
-            window_name = component.get(
-                "window_name", self.theme.window.get(name).get("window_name")
-            )
-            window_index = component.get(
-                "window_index",
-                self.theme.window.get(name).get("window_index"),
-            )
-            decorator = component.get(
-                "decorator", self.theme.window.get(name).get("decorator")
+        return {
+            component.name: (
+                self.produce_piece(component, "window_index")
+                if component.name == COMPACT_WINDOW
+                else f"{self.produce_piece(component, 'window', 'window_name')}"
+                f"{self.produce_piece(component, 'window_index')}"
+                f"{self.produce_piece(component, 'icon')}"
+                f"{self.produce_piece(component, 'decorator')} "
             )
+            for component in self.layout.window
+        }
 
-            fg_icon = component.get(
-                "fg_icon", self.theme.window.get(name).get("fg_icon")
-            )
-            bg_icon = component.get(
-                "bg_icon", self.theme.window.get(name).get("bg_icon")
-            )
-            fg_decorator = component.get(
-                "fg_decorator", self.theme.window.get(name).get("fg_decorator")
-            )
-            bg_decorator = component.get(
-                "bg_decorator", self.theme.window.get(name).get("bg_decorator")
-            )
-            fg_window = component.get(
-                "fg_window", self.theme.window.get(name).get("fg_window")
-            )
-            bg_window = component.get(
-                "bg_window", self.theme.window.get(name).get("bg_window")
-            )
-            fg_window_index = component.get(
-                "fg_window_index",
-                self.theme.window.get(name).get("fg_window_index"),
-            )
-            bg_window_index = component.get(
-                "bg_window_index",
-                self.theme.window.get(name).get("bg_window_index"),
-            )
+    def produce_adaptive_window(self, full, compact):
+        """
+        Return inactive window format which switches to compact format.
 
-            window_style = self.get_style_for_option(
-                fg_window, bg_window, style, window_name
-            )
-            window_index_style = self.get_style_for_option(
-                fg_window_index, bg_window_index, style, window_index
-            )
-            icon_style = self.get_style_for_option(
-                fg_icon, bg_icon, style, icon
-            )
-            decorator_style = self.get_style_for_option(
-                fg_decorator, bg_decorator, style, decorator
-            )
-            component_value = f"{window_style}{window_index_style}{icon_style}{decorator_style} "
-            windows[name] = component_value
+        The switch is done by tmux conditional format, so that it's
+        generated once and tmux decides by window count and client width
+        on every redraw. Windows next to the active window keep full
+        format.
 
-        return windows
+        Shell commands #(...) are not supported in the formats, since tmux
+        splits the conditional at commas inside them.
+        """
+        errors = [
+            f"window.{name}: shell command #(...) is not supported "
+            "with compact window"
+            for name, value in (("inactive", full), (COMPACT_WINDOW, compact))
+            if "#(" in value
+        ]
+        _raise_errors("configuration", errors)
+        limits = self.layout.window_limits
+        window_width = limits.window_width or estimate_width(full)
+        session_windows = "#{session_windows}"
+        too_many = tmux_format("e|>", session_windows, str(limits.max_windows))
+        too_wide = tmux_format(
+            "&&",
+            "#{client_width}",
+            tmux_format(
+                "e|>",
+                tmux_format("e|*", session_windows, str(window_width)),
+                tmux_format(
+                    "e|/",
+                    tmux_format(
+                        "e|*", "#{client_width}", str(limits.max_width)
+                    ),
+                    "100",
+                ),
+            ),
+        )
+        far_from_active = tmux_format(
+            "||",
+            tmux_format(
+                "e|<",
+                "#{window_index}",
+                tmux_format(
+                    "e|-", "#{active_window_index}", str(limits.neighbours)
+                ),
+            ),
+            tmux_format(
+                "e|>",
+                "#{window_index}",
+                tmux_format(
+                    "e|+", "#{active_window_index}", str(limits.neighbours)
+                ),
+            ),
+        )
+        # a single condition is used directly, since #{||:x} is always
+        # evaluated to empty by tmux
+        too_crowded = (
+            tmux_format("||", too_many, too_wide)
+            if limits.max_width
+            else too_many
+        )
+        use_compact = tmux_format("&&", too_crowded, far_from_active)
+        return tmux_format(
+            "?",
+            use_compact,
+            optimizer.escape_commas(compact),
+            optimizer.escape_commas(full),
+        )
 
-    def produce_status_right(self):
+    def produce_status_right(self, optimize=False):
         """Produce status right tmux options string."""
-        status_right = []
-        for options in self.status_right.values():
-            enabled = options.get("enabled", "on")
-            if not enabled:
-                continue
-            icon = options.get("icon", self.theme.status_right.get("icon"))
-            decorator = options.get(
-                "decorator", self.theme.status_right.get("decorator")
-            )
-            fg_format = options.get(
-                "fg_format", self.theme.status_right.get("fg_format")
-            )
-            bg_format = options.get(
-                "bg_format", self.theme.status_right.get("bg_format")
-            )
-            fg_icon = options.get(
-                "fg_icon", self.theme.status_right.get("fg_icon")
-            )
-            bg_icon = options.get(
-                "bg_icon", self.theme.status_right.get("bg_icon")
-            )
-            fg_decorator = options.get(
-                "fg_decorator", self.theme.status_right.get("fg_decorator")
-            )
-            bg_decorator = options.get(
-                "bg_decorator", self.theme.status_right.get("bg_decorator")
-            )
-            style = options.get("style", self.theme.status_right.get("style"))
-            _format = options.get("format", EMPTY)
-            format_style = f"{self.get_style_for_option(fg_format, bg_format, style, _format)}"
-            icon_style = (
-                f"{self.get_style_for_option(fg_icon, bg_icon, style, icon)}"
-            )
-            decorator_style = f"{self.get_style_for_option(fg_decorator, bg_decorator, style, decorator)}"
-            component_value = f"{decorator_style}{icon_style}{format_style}"
-            status_right.append(component_value)
-
-        return " ".join(status_right)
+        return self.produce_segments(
+            "status_right", ("decorator", "icon", "format"), optimize
+        )
 
     def get_style_for_option(self, foreground, background, style, option):
         """Construct style string with foreground and background."""
@@ -469,6 +988,154 @@ class Constructor:
             return None
         return f"set-option -gq {style_name} '{style_content}'"
 
+    def get_general_option(self, name, default):
+        """Return value of option in general/options section."""
+        value = (self.general.get("options") or {}).get(name)
+        return default if value is None else value
+
+    def terminal_colors_mode(self):
+        """
+        Return how to apply terminal colors of theme to panes.
+
+        off: not applied. panes keep colors of terminal emulator.
+        style: set by tmux option window-style.
+        osc: set by OSC sequences written to tty of each pane.
+        """
+        mode = str(
+            self.get_general_option(
+                "_eutmux_terminal_colors", TERMINAL_COLORS_OFF
+            )
+        ).lower()
+        if mode in (TERMINAL_COLORS_STYLE, TERMINAL_COLORS_OSC):
+            return mode
+        return TERMINAL_COLORS_OFF
+
+    def produce_terminal_commands(self):
+        """
+        Return tmux commands to apply terminal colors.
+
+        In style mode, window-style is set. In other modes, window-style set
+        by the last apply is unset. If there are OSC sequences, hooks are
+        set to write them to new panes, otherwise the hooks are removed.
+        """
+        commands = []
+        if self.terminal_colors_mode() == TERMINAL_COLORS_STYLE:
+            foreground = self.terminal.get("foreground")
+            background = self.terminal.get("background")
+            commands.append(
+                self.produce_option_command(
+                    "window-style", f"fg={foreground},bg={background}"
+                )
+            )
+            commands.append(
+                self.produce_option_command(WINDOW_STYLE_APPLIED, "1")
+            )
+        else:
+            # window-style of user in general options is kept
+            if self.get_general_option("window-style", None) is None:
+                commands.append(
+                    f"if-shell -F '#{{{WINDOW_STYLE_APPLIED}}}' "
+                    "'set-option -gu window-style'"
+                )
+            commands.append(f"set-option -gu {WINDOW_STYLE_APPLIED}")
+
+        has_sequences = bool(self.produce_terminal_sequences())
+        for hook in TERMINAL_HOOKS:
+            hook_name = f"'{hook}[{TERMINAL_HOOK_INDEX}]'"
+            if has_sequences:
+                commands.append(
+                    f'set-hook -g {hook_name} "run-shell -b '
+                    f'\'cat \\"{terminal_sequences_file()}\\" '
+                    "> #{pane_tty} 2>/dev/null'\""
+                )
+            else:
+                commands.append(f"set-hook -gu {hook_name}")
+        return commands
+
+    def produce_terminal_sequences(self):
+        """
+        Return OSC sequences to write to tty of panes.
+
+        In osc mode, terminal foreground and background are set. If option
+        _eutmux_terminal_ansi is on, 16 ANSI colors derived from the
+        colors of theme are set as well, in both style and osc mode.
+        """
+        mode = self.terminal_colors_mode()
+        foreground = self.terminal.get("foreground")
+        background = self.terminal.get("background")
+        if mode == TERMINAL_COLORS_OFF or not (
+            terminal.is_hex_color(foreground)
+            and terminal.is_hex_color(background)
+        ):
+            return EMPTY
+
+        colors = None
+        if is_on(self.get_general_option("_eutmux_terminal_ansi", False)):
+            palette_colors = list(self.status_line.values())
+            for component in (
+                self.layout.status_left
+                + self.layout.window
+                + self.layout.status_right
+            ):
+                palette_colors.extend(
+                    getattr(component, key) for key in ThemeSection.COLORS
+                )
+            colors = terminal.ansi_colors(
+                foreground, background, palette_colors
+            )
+        if mode == TERMINAL_COLORS_OSC:
+            return terminal.osc_sequences(foreground, background, colors)
+        return terminal.osc_sequences(colors=colors)
+
+    def optimizes_formats(self):
+        """Return True if option _eutmux_optimize_formats is on."""
+        return is_on(self.get_general_option("_eutmux_optimize_formats", True))
+
+    def produce_formats(self, optimize=False):
+        """
+        Return status-left, window and status-right formats by option name.
+
+        With optimize, formats are minimized before they are set. Format
+        strings are parsed by tmux on every redraw for every window and
+        client, so redundant style blocks are removed in advance.
+        """
+
+        def _optimize(value):
+            return optimizer.optimize(value) if optimize else value
+
+        window = {
+            name: _optimize(value)
+            for name, value in self.produce_window().items()
+        }
+        if COMPACT_WINDOW in window:
+            window["inactive"] = self.produce_adaptive_window(
+                window["inactive"], window.pop(COMPACT_WINDOW)
+            )
+        return {
+            "status-left": _optimize(self.produce_status_left(optimize)),
+            "window-status-current-format": window["active"],
+            "window-status-format": window["inactive"],
+            "status-right": _optimize(self.produce_status_right(optimize)),
+        }
+
+    def produce_format_bytes_command(self, formats, original_formats):
+        """
+        Return tmux command to report the size reduction of formats, which
+        are counted on the option values as they are set.
+        """
+
+        def _bytes(_formats):
+            return sum(len(value.encode(UTF_8)) for value in _formats.values())
+
+        before = _bytes(original_formats)
+        after = _bytes(formats)
+        saved = before - after
+        percentage = saved * 100 // before if before else 0
+        return self.produce_option_command(
+            "@eutmux_format_bytes",
+            f"{after}/{before} bytes, {saved} bytes ({percentage}%) saved",
+        )
+
     def produce_option_command(self, option, value):
         """Return tmux set option command."""
         return f"set-option -gq {option} '{value}'"
@@ -476,50 +1143,50 @@ class Constructor:
     def produce_option_commands(self):
         """Return all tmux set option commands."""
         status_line = self.produce_status_line()
-        status_left = self.produce_status_left()
-        window = self.produce_window()
-        status_right = self.produce_status_right()
+        original_formats = self.produce_formats()
+        formats = (
+            self.produce_formats(optimize=True)
+            if self.optimizes_formats()
+            else original_formats
+        )
 
         status_line_cmd = self.produce_option_command(
             "status-style", status_line
         )
-        status_left_cmd = self.produce_option_command(
-            "status-left", status_left
-        )
-        active_window_cmd = self.produce_option_command(
-            "window-status-current-format", window["active"]
-        )
-        inactive_window_cmd = self.produce_option_command(
-            "window-status-format", window["inactive"]
-        )
-        status_right_cmd = self.produce_option_command(
-            "status-right", status_right
-        )
         general_commands = self.produce_general_options_commands()
         option_commands = []
         option_commands.append(general_commands)
         option_commands.append(status_line_cmd)
-        option_commands.append(status_left_cmd)
-        option_commands.append(active_window_cmd)
-        option_commands.append(inactive_window_cmd)
-        option_commands.append(status_right_cmd)
+        option_commands.extend(
+            self.produce_option_command(option, value)
+            for option, value in formats.items()
+        )
+        option_commands.extend(self.produce_terminal_commands())
+        option_commands.append(
+            self.produce_format_bytes_command(formats, original_formats)
+        )
         return option_commands
 
 
-def init(config_file="eutmux.yaml"):
-    """Load config file, overwrite options by value from tmux.conf."""
-
+def eutmux_homes():
+    """Return eutmux configuration home and cache home."""
     # user can set customized config file under EUTMUX_CONFIG_HOME
     xdg_config_home = os.getenv(
         "XDG_CONFIG_HOME", f'{os.getenv("HOME")}/.config'
     )
     eutmux_config_home = f"{xdg_config_home}/eutmux"
+
+    # generated dynamic theme and config files are under EUTMUX_CACHE_HOME
+    return eutmux_config_home, cache_home()
+
+
+def load_config(config_file="eutmux.yaml"):
+    """Load config file. Generated dynamic config file has priority."""
+    eutmux_config_home, _ = eutmux_homes()
     _config_file = f"{eutmux_config_home}/{config_file}"
     if os.path.exists(_config_file):
         config_file = _config_file
 
-    eutmux = {}
-    set_option_commands = []
     eutmux_dynamic_config_file_name = get_tmux_option(
         "@eutmux_dynamic_config_file_name", config_file
     )
@@ -527,6 +1194,41 @@ def init(config_file="eutmux.yaml"):
     os.chdir(eutmux_workdir)
     with open(eutmux_dynamic_config_file_name, "r", encoding=UTF_8) as config:
         eutmux = yaml.safe_load(config)
+    if not isinstance(eutmux, dict):
+        _raise_errors("configuration", [f"expected a mapping, got {eutmux!r}"])
+    return eutmux
+
+
+def find_theme_file(theme_name):
+    """
+    Return theme file of theme name.
+
+    generated dynamic theme file has the highest priority. if dynamic theme
+    file doesn't exist under project, then check if it exists under
+    EUTMUX_CONFIG_HOME, if not, then fall-back to default them - eutmux
+    theme, otherwise, load the theme file from EUTMUX_CONFIG_HOME
+    """
+    eutmux_config_home, eutmux_cache_home = eutmux_homes()
+    theme_filename = f"{theme_name}.theme.yaml"
+    if os.path.exists(f"{eutmux_cache_home}/{theme_filename}"):
+        theme_filename = f"{eutmux_cache_home}/{theme_filename}"
+    elif not os.path.exists(theme_filename):
+        if os.path.exists(f"{eutmux_config_home}/{theme_filename}"):
+            theme_filename = f"{eutmux_config_home}/{theme_filename}"
+        else:
+            theme_filename = "eutmux.theme.yaml"
+    return theme_filename
+
+
+def terminal_sequences_file():
+    """Return file of OSC sequences of the last apply."""
+    _, eutmux_cache_home = eutmux_homes()
+    return f"{eutmux_cache_home}/{TERMINAL_SEQUENCES_FILENAME}"
+
+
+def load_constructor(config_file="eutmux.yaml"):
+    """Load config file and theme file, return constructor of them."""
+    eutmux = load_config(config_file)
 
     # if specified theme doesn't have corresponding file, then fall-back to
     # the default theme - eutmux theme.
@@ -536,32 +1238,71 @@ def init(config_file="eutmux.yaml"):
     dynamic_theme_name = get_tmux_option(
         "@eutmux_dynamic_theme_name", theme_name
     )
-    theme_filename = f"{dynamic_theme_name}.theme.yaml"
-
-    # if dynamic theme file doesn't exist under project, then check if it
-    # exists under EUTMUX_CONFIG_HOME, if not, then fall-back to default them -
-    # eutmux theme, otherwise, load the theme file from EUTMUX_CONFIG_HOME
-    if not os.path.exists(theme_filename):
-        if os.path.exists(f"{eutmux_config_home}/{theme_filename}"):
-            theme_filename = f"{eutmux_config_home}/{theme_filename}"
-        else:
-            theme_filename = "eutmux.theme.yaml"
+    theme_filename = find_theme_file(dynamic_theme_name)
     with open(theme_filename, "r", encoding=UTF_8) as theme_file:
         theme_config = yaml.safe_load(theme_file)
-        theme = Theme(theme_config)
+    return Constructor(eutmux, Theme.resolve(theme_config))
 
-        constructor = Constructor(eutmux, theme)
-        set_option_commands = constructor.produce_option_commands()
 
-    return ";".join(set_option_commands)
+def init(config_file="eutmux.yaml"):
+    """Load config file, overwrite options by value from tmux.conf."""
+    constructor = load_constructor(config_file)
+    return ";".join(constructor.produce_option_commands())
+
+
+def sync_terminal_colors(config_file="eutmux.yaml"):
+    """
+    Write terminal colors of theme to tty of all panes.
+
+    It's a separate step after tmux commands are sourced. The sequences are
+    saved for the hooks of new panes. Colors written by the last apply are
+    reset first, so that switching terminal colors off restores the colors
+    of terminal emulator.
+    """
+    sequences = load_constructor(config_file).produce_terminal_sequences()
+    # saved atomically, so that hooks of new panes never write a partial one
+    atomic_write(terminal_sequences_file(), sequences)
+    payload = sequences
+    if get_tmux_option(TERMINAL_SEQUENCES_APPLIED, EMPTY):
+        payload = terminal.RESET_SEQUENCES + sequences
+    terminal.write_to_panes(payload)
+    if sequences:
+        run_shell_command(
+            f"tmux set-option -gq {TERMINAL_SEQUENCES_APPLIED} 1"
+        )
+    else:
+        run_shell_command(f"tmux set-option -gqu {TERMINAL_SEQUENCES_APPLIED}")
+
+
+def display_error(error):
+    """Show error in tmux, since output of run-shell is not visible."""
+    message = " ".join(str(error).split()).replace("#", "##")
+    run_shell_command(
+        f"tmux display-message -d 0 {shlex.quote(f'eutmux: {message}')}"
+    )
+
+
+def produce_tmux_commands(config_file="eutmux.yaml"):
+    """
+    Return tmux commands of current theme.
+
+    If theme or configuration file is invalid, the errors are shown in tmux
+    and None is returned, so that the last good commands are kept.
+    """
+    try:
+        return init(config_file)
+    except ConfigError as error:
+        display_error(error)
+        return None
 
 
 def main():
     """Run."""
-    set_option_commands = init()
+    set_option_commands = produce_tmux_commands()
     if set_option_commands:
         for command in set_option_commands.split(";"):
             run_shell_command(f"tmux {command}")
+        sync_terminal_colors()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""Git status of pane directory for status line, served from cache."""
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+from utils import atomic_write
+from utils import cache_home as eutmux_cache_home
+
+UTF_8 = "utf-8"
+
+# seconds to wait for 'git status' in background refresh
+DEFAULT_TIMEOUT = 5
+# cached status is refreshed after max age even if HEAD and index are not
+# changed, since editing tracked files doesn't touch them
+DEFAULT_MAX_AGE = 30
+
+AHEAD = "↑"
+BEHIND = "↓"
+DIRTY = "*"
+
+
+def find_repository(path):
+    """
+    Find the repository which the path is in.
+
+    Return:
+        A tuple of work tree root and git directory, or None if path is not
+        in a repository. For linked work tree and submodule, '.git' is a
+        file which points to the git directory.
+    """
+    path = os.path.abspath(path)
+    while True:
+        dot_git = os.path.join(path, ".git")
+        if os.path.isdir(dot_git):
+            return path, dot_git
+        if os.path.isfile(dot_git):
+            try:
+                with open(dot_git, "r", encoding=UTF_8) as git_file:
+                    content = git_file.read().strip()
+            except OSError:
+                return None
+            if content.startswith("gitdir:"):
+                git_dir = content[len("gitdir:") :].strip()
+                return path, os.path.normpath(os.path.join(path, git_dir))
+            return None
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def read_head(git_dir):
+    """Return branch name, or abbreviated commit id if HEAD is detached."""
+    try:
+        with open(os.path.join(git_dir, "HEAD"), "r", encoding=UTF_8) as head:
+            content = head.read().strip()
+    except OSError:
+        return ""
+    if content.startswith("ref:"):
+        return content[len("ref:") :].strip().removeprefix("refs/heads/")
+    return content[:7]
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def state_key(git_dir):
+    """
+    Return key of repository state which the status depends on.
+
+    It's made of modification time of HEAD, index, the current branch ref
+    and FETCH_HEAD, so that checkout, staging, commit and fetch change it.
+    """
+    common_dir = git_dir
+    try:
+        with open(
+            os.path.join(git_dir, "commondir"), "r", encoding=UTF_8
+        ) as commondir:
+            common_dir = os.path.join(git_dir, commondir.read().strip())
+    except OSError:
+        pass
+    branch = read_head(git_dir)
+    return [
+        _mtime(os.path.join(git_dir, "HEAD")),
+        _mtime(os.path.join(git_dir, "index")),
+        _mtime(os.path.join(common_dir, "refs", "heads", branch)),
+        _mtime(os.path.join(common_dir, "FETCH_HEAD")),
+    ]
+
+
+def cache_file_for(git_dir, cache_home):
+    """Return cache file path of the repository."""
+    digest = hashlib.sha1(git_dir.encode(UTF_8)).hexdigest()
+    return os.path.join(cache_home, "git", f"{digest}.json")
+
+
+def read_cache(cache_file):
+    """Return cached record, or None if it's missing or broken."""
+    try:
+        with open(cache_file, "r", encoding=UTF_8) as cache:
+            return json.load(cache)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache(cache_file, record):
+    """Write cache file atomically."""
+    try:
+        atomic_write(cache_file, json.dumps(record))
+    except OSError:
+        # status is refreshed again next time
+        pass
+
+
+def parse_status(output):
+    """Parse output of 'git status --porcelain=v2 --branch'."""
+    status = {"branch": "", "ahead": 0, "behind": 0, "dirty": False}
+    oid = ""
+    for line in output.splitlines():
+        if line.startswith("# branch.oid "):
+            oid = line.split(" ", 2)[2]
+        elif line.startswith("# branch.head "):
+            status["branch"] = line.split(" ", 2)[2]
+        elif line.startswith("# branch.ab "):
+            ahead, behind = line.split(" ")[2:4]
+            status["ahead"] = abs(int(ahead))
+            status["behind"] = abs(int(behind))
+        elif line and not line.startswith("#"):
+            status["dirty"] = True
+    if status["branch"] == "(detached)":
+        status["branch"] = oid[:7]
+    return status
+
+
+def format_status(status):
+    """Format status for status line. e.g. 'main ↑1↓2 *'"""
+    pieces = [status["branch"]]
+    counts = ""
+    if status.get("ahead"):
+        counts += f"{AHEAD}{status['ahead']}"
+    if status.get("behind"):
+        counts += f"{BEHIND}{status['behind']}"
+    if counts:
+        pieces.append(counts)
+    if status.get("dirty"):
+        pieces.append(DIRTY)
+    return " ".join(pieces)
+
+
+def acquire_refresh_lock(lock_file):
+    """
+    Acquire lock so that only one refresh runs for a repository.
+
+    Return:
+        File descriptor holding the lock, or None if another refresh holds
+        it. The kernel releases the lock when the process exits, so a
+        killed refresh doesn't leave a stale lock behind.
+    """
+    try:
+        fd = os.open(lock_file, os.O_CREAT | os.O_WRONLY, 0o600)
+    except OSError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def refresh(root, git_dir, cache_home, timeout):
+    """Run 'git status' and save the result into the cache."""
+    cache_file = cache_file_for(git_dir, cache_home)
+    lock_file = f"{cache_file}.lock"
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    lock_fd = acquire_refresh_lock(lock_file)
+    if lock_fd is None:
+        return
+    try:
+        # key is taken before running git, so that changes made while it
+        # runs trigger another refresh
+        key = state_key(git_dir)
+        record = read_cache(cache_file) or {}
+        try:
+            # --no-optional-locks: don't refresh index, otherwise index
+            # mtime changes and status is refreshed again and again
+            output = subprocess.run(
+                [
+                    "git",
+                    "--no-optional-locks",
+                    "-C",
+                    root,
+                    "status",
+                    "--porcelain=v2",
+                    "--branch",
+                ],
+                capture_output=True,
+                check=True,
+                timeout=timeout,
+                encoding=UTF_8,
+                errors="replace",
+            ).stdout
+            status = parse_status(output)
+        except (OSError, subprocess.SubprocessError):
+            # keep the last known state. the key is saved anyway, so that
+            # a slow repository is retried after max age, not on every
+            # status line refresh.
+            status = record.get("status") or {}
+            status["branch"] = read_head(git_dir)
+        write_cache(
+            cache_file,
+            {"key": key, "time": time.time(), "status": status},
+        )
+    finally:
+        # the lock file is kept. removing it would let another refresh lock
+        # a new file while one still holds the removed file.
+        os.close(lock_fd)
+
+
+def spawn_refresh(root, git_dir, cache_home, timeout):
+    """Refresh cache in a detached process without waiting for it."""
+    subprocess.Popen(  # pylint: disable=consider-using-with
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--refresh",
+            "--timeout",
+            str(timeout),
+            "--git-dir",
+            git_dir,
+            "--cache-home",
+            cache_home,
+            root,
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def git_status(path, cache_home, timeout=DEFAULT_TIMEOUT, max_age=None):
+    """
+    Return formatted git status of the path from cache.
+
+    It never waits for git. If the cache is missing or out of date, a
+    background refresh is started and the cached status is returned with
+    the branch read from HEAD. Panes in the same repository
+    share the cache.
+    """
+    if max_age is None:
+        max_age = DEFAULT_MAX_AGE
+    repository = find_repository(path)
+    if repository is None:
+        return ""
+    root, git_dir = repository
+    record = read_cache(cache_file_for(git_dir, cache_home))
+    if (
+        record is None
+        or record.get("key") != state_key(git_dir)
+        or time.time() - record.get("time", 0) > max_age
+    ):
+        spawn_refresh(root, git_dir, cache_home, timeout)
+    status = dict((record or {}).get("status") or {})
+    # branch from HEAD is always up to date and cheap to read
+    status["branch"] = read_head(git_dir)
+    return format_status(status)
+
+
+def main():
+    """Run."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", nargs="?", default=os.curdir)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument("--max-age", type=float, default=DEFAULT_MAX_AGE)
+    parser.add_argument(
+        "--cache-home",
+        default=eutmux_cache_home(),
+    )
+    parser.add_argument("--git-dir", help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--refresh", action="store_true", help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+    if args.refresh:
+        refresh(args.path, args.git_dir, args.cache_home, args.timeout)
+        return
+    print(git_status(args.path, args.cache_home, args.timeout, args.max_age))
+
+
+if __name__ == "__main__":
+    main()
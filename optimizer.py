@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""Minimize tmux format strings by merging and dropping style blocks."""
+
+STYLE_START = "#["
+STYLE_END = "]"
+
+# token kinds
+STYLE = "style"
+TEXT = "text"
+# nested format which contains style blocks, or shell command whose output
+# could contain style blocks. styles could be changed by them, so it's a
+# barrier for merging styles.
+BARRIER = "barrier"
+
+COLOR_KEYS = ("fg", "bg", "us")
+ATTRIBUTES = (
+    "bold",
+    "dim",
+    "underscore",
+    "blink",
+    "reverse",
+    "hidden",
+    "italics",
+    "overline",
+    "strikethrough",
+    "double-underscore",
+    "curly-underscore",
+    "dotted-underscore",
+    "dashed-underscore",
+)
+
+
+def skip_nested(value, start, opening, closing):
+    """Return index after the closing character matching the one at start."""
+    depth = 0
+    index = start
+    while index < len(value):
+        if value.startswith("##", index):
+            index += 2
+            continue
+        char = value[index]
+        if value.startswith(f"#{opening}", index):
+            depth += 1
+            index += 2
+            continue
+        if opening == "(" and char == "(":
+            depth += 1
+        elif char == closing:
+            depth -= 1
+            if depth == 0:
+                return index + 1
+        index += 1
+    return len(value)
+
+
+def tokenize(value):
+    """
+    Split tmux format string into tokens.
+
+    Return:
+        A list of (kind, text) tuples. For STYLE tokens, text is the
+        content between '#[' and ']'.
+    """
+    tokens = []
+    text = []
+    index = 0
+
+    def flush_text():
+        if text:
+            tokens.append((TEXT, "".join(text)))
+            text.clear()
+
+    while index < len(value):
+        if value.startswith("##", index):
+            text.append("##")
+            index += 2
+        elif value.startswith(STYLE_START, index):
+            end = value.find(STYLE_END, index + 2)
+            if end < 0:
+                text.append(value[index:])
+                break
+            flush_text()
+            tokens.append((STYLE, value[index + 2 : end]))
+            index = end + 1
+        elif value.startswith("#{", index) or value.startswith("#(", index):
+            opening = value[index + 1]
+            end = skip_nested(
+                value, index, opening, "}" if opening == "{" else ")"
+            )
+            nested = value[index:end]
+            if opening == "(" or STYLE_START in nested:
+                flush_text()
+                tokens.append((BARRIER, nested))
+            else:
+                text.append(nested)
+            index = end
+        else:
+            text.append(value[index])
+            index += 1
+    flush_text()
+    return tokens
+
+
+def parse_style(style):
+    """
+    Parse style such as 'fg=#ffffff,bg=#000000,nobold' to a dict.
+
+    Return:
+        A dict whose key is color name or attribute name, and value is the
+        style piece. Or None if style has pieces which can't be merged
+        safely. e.g. 'default', 'align=left', 'list=on'
+    """
+    parsed = {}
+    for piece in style.replace(" ", ",").split(","):
+        piece = piece.strip()
+        if piece == "":
+            continue
+        if "=" in piece:
+            key = piece.split("=", 1)[0]
+            if key not in COLOR_KEYS:
+                return None
+        else:
+            key = piece[2:] if piece.startswith("no") else piece
+            if key not in ATTRIBUTES:
+                return None
+        parsed.pop(key, None)
+        parsed[key] = piece
+    return parsed
+
+
+def optimize(value):
+    """
+    Return minimized tmux format string which renders the same.
+
+    - adjacent style blocks are merged into one block
+    - style block followed by another style block is dropped if the
+      latter overrides all of it
+    - style block same with the effective one is dropped
+    - empty pieces such as '#[]' are dropped
+    """
+    pieces = []
+    pending = None
+    last = None
+
+    def flush_pending():
+        nonlocal pending, last
+        if pending is None:
+            return
+        style = ",".join(pending.values())
+        if style != last:
+            pieces.append(f"{STYLE_START}{style}{STYLE_END}")
+            last = style
+        pending = None
+
+    for kind, text in tokenize(value):
+        if kind == STYLE:
+            parsed = parse_style(text)
+            if parsed is None:
+                flush_pending()
+                pieces.append(f"{STYLE_START}{text}{STYLE_END}")
+                last = None
+            elif parsed:
+                pending = pending or {}
+                # keep the order of pieces in which they are applied
+                for key, piece in parsed.items():
+                    pending.pop(key, None)
+                    pending[key] = piece
+        elif kind == TEXT:
+            flush_pending()
+            pieces.append(text)
+        else:
+            flush_pending()
+            pieces.append(text)
+            last = None
+    flush_pending()
+    return "".join(pieces)
+
+
+def escape_commas(value):
+    """
+    Escape commas as '#,' to use value in branch of conditional format.
+
+    Commas in nested formats or shell commands are not escaped.
+    """
+    pieces = []
+    index = 0
+    while index < len(value):
+        if value.startswith("##", index):
+            pieces.append("##")
+            index += 2
+        elif value.startswith("#{", index) or value.startswith("#(", index):
+            opening = value[index + 1]
+            end = skip_nested(
+                value, index, opening, "}" if opening == "{" else ")"
+            )
+            pieces.append(value[index:end])
+            index = end
+        elif value[index] == ",":
+            pieces.append("#,")
+            index += 1
+        else:
+            pieces.append(value[index])
+            index += 1
+    return "".join(pieces)
+
+
+def has_command_commas(value):
+    """
+    Return True if a shell command #(...) out of nested formats has commas.
+
+    tmux doesn't skip shell commands when it splits conditional format, and
+    such commas can't be escaped by escape_commas.
+    """
+    index = 0
+    while index < len(value):
+        if value.startswith("##", index):
+            index += 2
+        elif value.startswith("#{", index) or value.startswith("#(", index):
+            opening = value[index + 1]
+            end = skip_nested(
+                value, index, opening, "}" if opening == "{" else ")"
+            )
+            if opening == "(" and "," in value[index:end]:
+                return True
+            index = end
+        else:
+            index += 1
+    return False
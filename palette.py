@@ -2,9 +2,14 @@
 """Palette and Colors."""
 
 import colorsys
+import hashlib
+import os
 import random
 
-from utils import get_tmux_option
+from utils import atomic_write, get_tmux_option
+from utils import cache_home as eutmux_cache_home
+
+UTF_8 = "utf-8"
 
 
 def hex2hls(hex_color):
@@ -219,6 +224,180 @@ def generate_palette():
     return Palette().generate_palette()
 
 
+def image_hash(image_path, chunk_size=1 << 20):
+    """Return sha256 hex digest of image file content."""
+    digest = hashlib.sha256()
+    with open(image_path, "rb") as image_file:
+        for chunk in iter(lambda: image_file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_pixels(image_path, max_size=128):
+    """
+    Load image as (n, 3) array of RGB values in [0, 1].
+
+    Image is downsampled to at most max_size pixels on the longer side
+    while it's decoded (JPEG draft mode) or right after, so that big
+    images such as 4K wallpapers are still clustered quickly.
+    """
+    # numpy and pillow are only needed for palette from image
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(image_path) as image:
+        image.draft("RGB", (max_size, max_size))
+        image = image.convert("RGB")
+        factor = max(image.size) // max_size
+        if factor > 1:
+            image = image.reduce(factor)
+        image.thumbnail((max_size, max_size))
+        pixels = np.asarray(image, dtype=np.float32).reshape(-1, 3)
+    return pixels / 255.0
+
+
+def squared_distances(pixels, centers):
+    """Return (n, k) squared distances between pixels and centers."""
+    return ((pixels[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+
+
+def kmeans(pixels, n_clusters, seed=0, max_iterations=20, tolerance=1e-4):
+    """
+    Cluster pixels by vectorized k-means with k-means++ initialization.
+
+    Return:
+        Cluster centers and the population of each cluster, sorted by
+        population from most to least.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(pixels))
+    centers = np.empty((n_clusters, 3), dtype=pixels.dtype)
+    centers[0] = pixels[rng.integers(len(pixels))]
+    distances = ((pixels - centers[0]) ** 2).sum(axis=1)
+    for index in range(1, n_clusters):
+        total = distances.sum()
+        if total == 0:
+            centers[index:] = centers[0]
+            break
+        centers[index] = pixels[rng.choice(len(pixels), p=distances / total)]
+        distances = np.minimum(
+            distances, ((pixels - centers[index]) ** 2).sum(axis=1)
+        )
+
+    for _ in range(max_iterations):
+        distances = squared_distances(pixels, centers)
+        labels = distances.argmin(axis=1)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, pixels)
+        new_centers = centers.copy()
+        populated = counts > 0
+        new_centers[populated] = sums[populated] / counts[populated, None]
+        # move empty cluster to the pixel farthest from its center
+        for index in np.flatnonzero(~populated):
+            farthest = distances[np.arange(len(pixels)), labels].argmax()
+            new_centers[index] = pixels[farthest]
+            distances[farthest] = 0
+        shift = np.abs(new_centers - centers).max()
+        centers = new_centers
+        if shift < tolerance:
+            break
+
+    labels = squared_distances(pixels, centers).argmin(axis=1)
+    counts = np.bincount(labels, minlength=n_clusters)
+    order = counts.argsort()[::-1]
+    return centers[order], counts[order]
+
+
+def gradations(rgb_color, n_colors, lightest, darkest, max_saturation=0.7):
+    """
+    Return n hex colors with hue of the given color and lightness from
+    lightest to darkest.
+    """
+    hue, _, saturation = colorsys.rgb_to_hls(*map(float, rgb_color))
+    saturation = min(saturation, max_saturation)
+    step = (darkest - lightest) / max(n_colors - 1, 1)
+    return [
+        rgb2hex(
+            colorsys.hls_to_rgb(hue, lightest + step * index, saturation)
+        ).lower()
+        for index in range(n_colors)
+    ]
+
+
+def generate_image_palette(
+    image_path,
+    *,
+    colors_total=3,
+    dark_colors_total=3,
+    colors_gradations=15,
+    dark_colors_gradations=18,
+    cache_home=None,
+):
+    """
+    Generate palette from image such as desktop wallpaper.
+
+    Image pixels are clustered into (colors_total + dark_colors_total)
+    colors. The most dominant clusters become dark colors which are used
+    for status-line background, the others become colors. Each cluster
+    center is expanded to gradations which follow the same layout as
+    dynamic palette. i.e. colors are from dark to light, e.g. C_01_00 is
+    the darkest; dark colors are from light to dark, e.g. C_04_00 is the
+    lightest.
+
+    Palette is cached by image content hash under cache_home.
+
+    Return:
+        A list of palette colors. e.g. ["C_01_00:#2b2f3a", ...]
+    """
+    palette_home = f"{cache_home or eutmux_cache_home()}/palettes"
+    digest = image_hash(image_path)
+    cache_file = (
+        f"{palette_home}/{digest}-{colors_total}.{dark_colors_total}."
+        f"{colors_gradations}.{dark_colors_gradations}.txt"
+    )
+    if os.path.exists(cache_file):
+        with open(cache_file, "r", encoding=UTF_8) as cached:
+            return cached.read().split()
+
+    pixels = load_pixels(image_path)
+    centers, _ = kmeans(
+        pixels, colors_total + dark_colors_total, seed=int(digest[:8], 16)
+    )
+    centers = list(centers)
+    # image has less distinct colors than required, reuse the dominant ones
+    while len(centers) < colors_total + dark_colors_total:
+        centers.extend(centers)
+    dark_colors = centers[0:dark_colors_total]
+    colors = centers[dark_colors_total : dark_colors_total + colors_total]
+
+    palette_colors = []
+    base_color_sequence = 0
+    for center in colors:
+        base_color_sequence += 1
+        for colormap_sequence, hex_color in enumerate(
+            gradations(center, colors_gradations, 0.25, 0.92)
+        ):
+            palette_colors.append(
+                f"C_{base_color_sequence:02d}_{colormap_sequence:02d}:"
+                f"{hex_color}"
+            )
+    for center in dark_colors:
+        base_color_sequence += 1
+        for colormap_sequence, hex_color in enumerate(
+            gradations(center, dark_colors_gradations, 0.93, 0.07)
+        ):
+            palette_colors.append(
+                f"C_{base_color_sequence:02d}_{colormap_sequence:02d}:"
+                f"{hex_color}"
+            )
+
+    atomic_write(cache_file, "\n".join(palette_colors))
+    return palette_colors
+
+
 def main():
     """Test."""
     palette = Palette()
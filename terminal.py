@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Synchronize terminal colors of all panes with theme."""
+import os
+import re
+
+from peelee.color_utils import hex2hls, hls2hex
+
+from utils import run_shell_command
+
+OSC = "\033]"
+ST = "\033\\"
+# OSC 110, 111 and 104 reset foreground, background and ANSI colors to the
+# ones of terminal emulator
+RESET_SEQUENCES = f"{OSC}110{ST}{OSC}111{ST}{OSC}104{ST}"
+REGEX_HEX_COLOR = re.compile(r"^#[0-9a-fA-F]{6}$")
+
+# ANSI color index -> hue degree, for red, green, yellow, blue, magenta, cyan
+ANSI_HUES = {1: 0, 2: 120, 3: 60, 4: 240, 5: 300, 6: 180}
+# palette colors with hue out of the range are not used for ANSI color
+MAX_HUE_DISTANCE = 30 / 360
+MIN_SATURATION = 0.2
+
+
+def is_hex_color(value):
+    """Return True if value is HEX color code such as #ff7834."""
+    return isinstance(value, str) and REGEX_HEX_COLOR.match(value) is not None
+
+
+def hue_distance(hue_1, hue_2):
+    """Return distance of 2 hue values in [0, 1) on the color wheel."""
+    distance = abs(hue_1 - hue_2) % 1.0
+    return min(distance, 1.0 - distance)
+
+
+def ansi_colors(foreground, background, palette_colors):
+    """
+    Derive 16 ANSI colors from the palette colors of theme.
+
+    Black and white are from terminal background and foreground. Other
+    colors are the palette colors with the closest hue; if the palette
+    doesn't have such color, then it's generated with the standard hue.
+
+    Return:
+        A list of 16 HEX color codes, index is the ANSI color index.
+    """
+    candidates = [
+        hex2hls(_color)
+        for _color in set(palette_colors)
+        if is_hex_color(_color)
+    ]
+    candidates = [hls for hls in candidates if hls[2] >= MIN_SATURATION]
+    bg_hue, bg_lightness, bg_saturation = hex2hls(background)
+    fg_hue, fg_lightness, fg_saturation = hex2hls(foreground)
+
+    colors = [None] * 16
+    colors[0] = background
+    colors[8] = hls2hex((bg_hue, min(bg_lightness + 0.25, 1.0), bg_saturation))
+    colors[7] = hls2hex((fg_hue, fg_lightness * 0.85, fg_saturation))
+    colors[15] = foreground
+    for index, degree in ANSI_HUES.items():
+        hue = degree / 360
+        lightness, saturation = 0.55, 0.6
+        if candidates:
+            closest = min(
+                candidates, key=lambda hls: hue_distance(hls[0], hue)
+            )
+            if hue_distance(closest[0], hue) <= MAX_HUE_DISTANCE:
+                hue, lightness, saturation = closest
+        lightness = min(max(lightness, 0.45), 0.65)
+        colors[index] = hls2hex((hue, lightness, saturation))
+        colors[index + 8] = hls2hex((hue, lightness + 0.12, saturation))
+    return [_color.lower() for _color in colors]
+
+
+def x11_color(hex_color):
+    """Convert HEX color code to X11 color spec. e.g. rgb:ff/78/34"""
+    hex_color = hex_color.lstrip("#").lower()
+    return f"rgb:{hex_color[0:2]}/{hex_color[2:4]}/{hex_color[4:6]}"
+
+
+def osc_sequences(foreground=None, background=None, colors=None):
+    """
+    Return OSC sequences to set terminal colors.
+
+    OSC 10 and OSC 11 set default foreground and background. OSC 4 sets
+    the ANSI colors. All sequences are in one string so that they could
+    be written by one write.
+    """
+    sequences = []
+    if foreground:
+        sequences.append(f"{OSC}10;{x11_color(foreground)}{ST}")
+    if background:
+        sequences.append(f"{OSC}11;{x11_color(background)}{ST}")
+    if colors:
+        specs = ";".join(
+            f"{index};{x11_color(_color)}"
+            for index, _color in enumerate(colors)
+        )
+        sequences.append(f"{OSC}4;{specs}{ST}")
+    return "".join(sequences)
+
+
+def list_pane_ttys():
+    """Return ttys of all panes in all sessions by one tmux call."""
+    output = run_shell_command("tmux list-panes -a -F '#{pane_tty}'", "")
+    return sorted(set(tty for tty in output.splitlines() if tty))
+
+
+def write_to_panes(sequences, ttys=None):
+    """
+    Write sequences to tty of each pane.
+
+    Each tty is written by one buffered write. Panes which are gone or
+    not writable are skipped.
+
+    Return:
+        The number of ttys written.
+    """
+    if not sequences:
+        return 0
+    if ttys is None:
+        ttys = list_pane_ttys()
+    payload = sequences.encode()
+    written = 0
+    for tty in ttys:
+        try:
+            fd = os.open(tty, os.O_WRONLY | os.O_NOCTTY | os.O_NONBLOCK)
+        except OSError:
+            continue
+        try:
+            os.write(fd, payload)
+            written += 1
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+    return written
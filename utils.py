@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 """Provide utilities functions."""
+import os
 import shlex
 import subprocess
+import tempfile
 from subprocess import TimeoutExpired
 
 UTF_8 = "utf-8"
@@ -35,6 +37,31 @@ def run_shell_command(command, default_output=None):
     return output if output and len(output) > 0 else default_output
 
 
+def cache_home():
+    """Return eutmux cache home, EUTMUX_CACHE_HOME or under XDG cache."""
+    xdg_cache_home = os.getenv("XDG_CACHE_HOME", f'{os.getenv("HOME")}/.cache')
+    return os.getenv("EUTMUX_CACHE_HOME", f"{xdg_cache_home}/eutmux")
+
+
+def atomic_write(file_path, content):
+    """
+    Write content to file atomically, so that readers never see a partial
+    file. The temporary file is removed and the error is raised if writing
+    fails.
+    """
+    file_dir = os.path.dirname(file_path)
+    os.makedirs(file_dir, exist_ok=True)
+    fd, temp_file = tempfile.mkstemp(dir=file_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding=UTF_8) as temp:
+            temp.write(content)
+        os.replace(temp_file, file_path)
+    except OSError:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+
 if __name__ == "__main__":
     value = get_tmux_option("@eutmux_base_color_total", 5)
     print(value)
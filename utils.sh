@@ -81,3 +81,27 @@ readable(){
     fi
     return ${TRUE}
 }
+
+# print a new temporary file path in the same directory of the given target
+# file, so that it could be renamed to the target file atomically.
+temp_file_for(){
+    mktemp "$(dirname "${1}")/.eutmux.XXXXXX"
+}
+
+# acquire lock on file ${1} by flock. wait at most ${2} seconds. the lock is
+# released by kernel when the process exits, so a killed process never
+# leaves a stale lock behind.
+acquire_lock(){
+    local lock_file timeout
+    lock_file="${1}"
+    timeout="${2:-30}"
+    exec {LOCK_FD}>>"${lock_file}" || return ${FALSE}
+    flock -w "${timeout}" "${LOCK_FD}"
+}
+
+release_lock(){
+    if [ -n "${LOCK_FD}" ];then
+       flock -u "${LOCK_FD}"
+       exec {LOCK_FD}>&-
+    fi
+}